@@ -9,7 +9,7 @@ from math import ceil, isnan, isinf
 from itertools import product
 
 from tools import AlgoOpts, LowLevelOpts, Params, PhysicalCost
-from error_correction import ErrCorrCode
+from error_correction import ErrCorrCode, select_swap_size
 
 
 # %% Ancillary functions
@@ -20,6 +20,10 @@ def logical_qubits(params: Params, verb=True):
     """
     if params.algo.windowed:
         res = 4*params.algo.n + 3*params.algo.m + params.algo.we - 1
+        if params.algo.lookup == 'sqrt':
+            # Additional output registers of select-swap lookup
+            w = params.algo.we + params.algo.wm
+            res += (2**select_swap_size(w, params.algo.n) - 1)*params.algo.n
     else:
         res = 3*(params.algo.n + params.algo.m) + 1
     if verb:
@@ -44,13 +48,51 @@ def correct_all(err_corr: ErrCorrCode):
     return err_corr.correct_time*logical_qubits(err_corr.params, verb=False)/2
 
 
-def memory_limited_time(err_corr: ErrCorrCode):
-    """Cycle-time when limited by memory readout time."""
-    # Time to access 1 qubit with 4Γ/10 hypothesis
-    speed = 4 * 12e6 / 10  # qubit/s
+# Time to access 1 mode (storing 1 physical qubit) with 4Γ/10 hypothesis
+READOUT_SPEED = 4 * 12e6 / 10  # mode/s
+
+
+def memory_limited_time(err_corr: ErrCorrCode, speed=READOUT_SPEED):
+    """Cycle-time when limited by memory readout time.
+
+    All the memory qubits are read sequentially at 'speed' (mode/s).
+    """
     return qubits_en_memoire(err_corr, verb=False) / speed
 
 
+def modes_limited_time(err_corr: ErrCorrCode, speed=READOUT_SPEED,
+                       channels=None):
+    """Cycle-time when limited by multimode memory readout time.
+
+    The spatial modes are shared among 'channels' readout channels, each
+    reading its modes sequentially at 'speed' (mode/s). channels=None means
+    one channel per spatial mode.
+    """
+    space_modes, time_modes = modes_en_memoire(err_corr)
+    if channels is None:
+        channels = space_modes
+    return ceil(space_modes / channels) * time_modes / speed
+
+
+def effective_time(err_corr: ErrCorrCode, cost: PhysicalCost,
+                   speed=READOUT_SPEED, channels=None):
+    """Average runtime, including memory bottlenecks.
+
+    Maximum of:
+        - computation time;
+        - memory readout time: cycle-time is at least modes_limited_time;
+        - memory refresh time: correcting all the memory must fit between two
+          readings of a given qubit.
+    """
+    compute = cost.exp_t
+    readout = (compute * modes_limited_time(err_corr, speed, channels)
+               / err_corr.params.low_level.tc)
+    refresh = (compute * correct_all(err_corr)
+               / err_corr.temps_inter_lectures().t)
+    return max(time for time in (compute, readout, refresh)
+               if not isnan(time))
+
+
 def ne_size(n):
     """Estimates exponent size n_e for some integer to factor size n.
 
@@ -65,23 +107,29 @@ def ne_size(n):
 
 
 # %% Optimization
-def iterate(base_params: Params, **kwargs):
+# Largest total window size (we + wm) explored with large_windows.
+MAX_WINDOW = 30
+
+
+def iterate(base_params: Params, large_windows=False, **kwargs):
     """Generate iterator on all free parameters of the algorithm.
 
     Possible kwargs: d1s, ds, wes, wms, ms
+    If large_windows, we and wm are explored up to we + wm = MAX_WINDOW.
     """
     # pylint: disable=C0103
+    windows = range(1, MAX_WINDOW) if large_windows else range(1, 10)
     if base_params.type == '3dcolor':
         ranges = dict(d1s=(None,),
                       ds=range(1, 100, 2),
-                      wes=range(1, 10),
-                      wms=range(1, 10),
+                      wes=windows,
+                      wms=windows,
                       ms=range(1, 40))
     elif base_params.type is None:
         ranges = dict(d1s=(None,),
                       ds=(None,),
-                      wes=range(1, 10),
-                      wms=range(1, 10),
+                      wes=windows,
+                      wms=windows,
                       ms=range(1, 40))
     else:
         raise ValueError("params.type not valid!")
@@ -91,14 +139,21 @@ def iterate(base_params: Params, **kwargs):
         # we and wm have same role, no need to explore all the parameter space
         if wm is not None and we is not None and wm > we:
             continue
+        if large_windows and we is not None and we + wm > MAX_WINDOW:
+            continue
         yield base_params._replace(
             algo=base_params.algo._replace(we=we, wm=wm, m=m),
             low_level=base_params.low_level._replace(d1=d1, d=d))
 
 
-def metrique(cost: PhysicalCost, qubits, biais=1):
-    """Score the quality of resource cost."""
-    return cost.exp_t * qubits**biais
+def metrique(cost: PhysicalCost, qubits, biais=1, time=None):
+    """Score the quality of resource cost.
+
+    'time' replaces the average runtime of cost if given.
+    """
+    if time is None:
+        time = cost.exp_t
+    return time * qubits**biais
 
 
 def prepare_ressources(params: Params):
@@ -109,16 +164,25 @@ def prepare_ressources(params: Params):
     return cost, qubits
 
 
-def find_best_params(base_params: Params, biais=1, **kwargs):
-    """Find the best parameter set."""
+def find_best_params(base_params: Params, biais=1, speed=None,
+                     channels=None, **kwargs):
+    """Find the best parameter set.
+
+    kwargs are passed to iterate (ranges of parameters, large_windows).
+    If memory readout 'speed' (mode/s) is given, runtime includes memory
+    bottlenecks with 'channels' readout channels (see effective_time).
+    """
     best = float('inf')
     best_params = None
     for params in iterate(base_params, **kwargs):
         try:
-            cost, qubits = prepare_ressources(params)
+            err_corr = ErrCorrCode(params)
+            cost, qubits = err_corr.modular_exp(), err_corr.proc_qubits
         except RuntimeError:
             continue
-        score = metrique(cost, qubits, biais)
+        time = (None if speed is None
+                else effective_time(err_corr, cost, speed, channels))
+        score = metrique(cost, qubits, biais, time)
         if score < best:
             best = score
             best_params = params
@@ -272,6 +336,29 @@ if __name__ == '__main__':
         cost_ctrl.exp_t * memory_limited_time(best_err_corr_ctrl)
         / best_params_ctrl.low_level.tc, unicode=True))
 
+    # Memory-aware optimization
+    print("\n"*2)
+    print("Memory-aware optimization")
+    print("=========================")
+    best_params_mem = find_best_params(params, biais=1, speed=READOUT_SPEED)
+    best_err_corr_mem = ErrCorrCode(best_params_mem)
+    cost_mem, qubits_mem = prepare_ressources(best_params_mem)
+    print("Best parameters:", best_params_mem)
+    print("Best cost:", cost_mem, ";", qubits_mem)
+    print("Effective time:", format_time(
+        effective_time(best_err_corr_mem, cost_mem, READOUT_SPEED),
+        unicode=True))
+    print("With 1e5 readout channels:")
+    best_params_ch = find_best_params(params, biais=1, speed=READOUT_SPEED,
+                                      channels=1e5)
+    best_err_corr_ch = ErrCorrCode(best_params_ch)
+    cost_ch, qubits_ch = prepare_ressources(best_params_ch)
+    print("Best parameters:", best_params_ch)
+    print("Best cost:", cost_ch, ";", qubits_ch)
+    print("Effective time:", format_time(
+        effective_time(best_err_corr_ch, cost_ch, READOUT_SPEED, 1e5),
+        unicode=True))
+
     # Table
     print("\n"*2)
     print("Table")
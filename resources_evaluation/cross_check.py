@@ -0,0 +1,511 @@
+#!/usr/bin/env python3
+# coding: utf-8
+"""
+Differential testing of the cost evaluation engines.
+
+Each engine is a way of evaluating the ErrCorrCode methods; all of them run
+the same model code, cout_shor.find_best_params included. On edge-case and
+random points, the harness compares every engine, and a frozen snapshot of
+the results of the code before the engines were introduced
+(cross_check_baseline.json), with a high-precision decimal engine. It also
+reports their speed relative to the 'baseline' engine, which restores the
+arithmetic of the code before the engines.
+
+@author: Élie Gouzien
+"""
+import argparse
+import json
+import numbers
+import os
+import random
+from contextlib import contextmanager, nullcontext
+from decimal import Decimal, localcontext
+from math import isclose, isnan
+from sys import float_info
+from time import perf_counter
+
+import cout_shor
+import error_correction
+from tools import AlgoOpts, LowLevelOpts, Params, PhysicalCost
+from error_correction import ErrCorrCode, ThreeDGaugeCode, NoCorrCode
+from cout_shor import find_best_params, ne_size
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'cross_check_baseline.json')
+
+
+# %% Engines
+class OperatorAccumulator:
+    """Same interface as CostAccumulator, with PhysicalCost operators only."""
+
+    def __init__(self):
+        """Start from an empty circuit."""
+        self.cost = None
+
+    def add(self, cost, k=1):
+        """Add serial execution of cost k times (k can be float)."""
+        cost = cost*k
+        self.cost = cost if self.cost is None else self.cost + cost
+        return self
+
+    def total(self):
+        """Accumulated cost."""
+        return self.cost
+
+
+@contextmanager
+def _patched(obj, **attributes):
+    """Temporarily replace attributes of obj."""
+    saved = {name: getattr(obj, name) for name in attributes}
+    for name, value in attributes.items():
+        setattr(obj, name, value)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(obj, name, value)
+
+
+@contextmanager
+def operators_engine():
+    """Evaluate ErrCorrCode with PhysicalCost operators only.
+
+    Same arithmetic as the default engine, without CostAccumulator.
+    """
+    with _patched(error_correction, CostAccumulator=OperatorAccumulator):
+        yield
+
+
+def _old_add(self, other):
+    """Operator + of the code before the engines."""
+    if not isinstance(other, PhysicalCost):
+        return NotImplemented
+    return PhysicalCost(1 - (1 - self.p)*(1 - other.p), self.t + other.t)
+
+
+def _old_mul(self, other):
+    """Operator * of the code before the engines."""
+    if not isinstance(other, numbers.Real):
+        return NotImplemented
+    return PhysicalCost(1 - (1 - self.p)**other, self.t * other)
+
+
+def _old_sub(self, other):
+    """Operator - of the code before the engines."""
+    return self + (-1 * other)
+
+
+def _old_or(self, other):
+    """Operator | of the code before the engines."""
+    if not isinstance(other, PhysicalCost):
+        return NotImplemented
+    return PhysicalCost(1 - (1 - self.p)*(1-other.p), max(self.t, other.t))
+
+
+def _old_3dcolor_init(self, params: Params):
+    """ThreeDGaugeCode.__init__ with CNOT error of the code before engines."""
+    _NEW_INITS[ThreeDGaugeCode](self, params)
+    self.cnot = PhysicalCost(1 - (1 - self.gate1.p)**2, self.cnot.t)
+
+
+def _old_nocorr_init(self, params: Params):
+    """NoCorrCode.__init__ with gate errors of the code before engines."""
+    _NEW_INITS[NoCorrCode](self, params)
+    pp = params.low_level.pp
+    self.cnot = PhysicalCost(1 - (1 - pp)**2, self.cnot.t)
+    self.toffoli = PhysicalCost(1 - (1 - pp)**3, self.toffoli.t)
+
+
+_NEW_INITS = {ThreeDGaugeCode: ThreeDGaugeCode.__init__,
+              NoCorrCode: NoCorrCode.__init__}
+
+
+@contextmanager
+def baseline_engine():
+    """Evaluate ErrCorrCode as the code before the engines did.
+
+    PhysicalCost operators and gate errors are restored, and used without
+    CostAccumulator: reference for speed.
+    """
+    with _patched(error_correction, CostAccumulator=OperatorAccumulator), \
+            _patched(PhysicalCost, __add__=_old_add, __mul__=_old_mul,
+                     __sub__=_old_sub, __or__=_old_or), \
+            _patched(ThreeDGaugeCode, __init__=_old_3dcolor_init), \
+            _patched(NoCorrCode, __init__=_old_nocorr_init):
+        yield
+
+
+# Significant digits of the decimal engine.
+DIGITS = 60
+
+
+def _log1m(p):
+    """ln(1 - p), for Decimal p < 1, to DIGITS significant digits."""
+    with localcontext() as ctx:
+        ctx.prec = DIGITS + max(0, -p.adjusted())
+        return (1 - p).ln()
+
+
+def _m_expm1(x):
+    """1 - exp(x), for Decimal x, to DIGITS significant digits."""
+    with localcontext() as ctx:
+        ctx.prec = DIGITS + max(0, -x.adjusted())
+        res = 1 - x.exp()
+    return +res
+
+
+def _dec_add(self, other):
+    """Operator + in Decimal."""
+    if not isinstance(other, PhysicalCost):
+        return NotImplemented
+    p_1, p_2 = Decimal(self.p), Decimal(other.p)
+    return PhysicalCost(p_1 + p_2*(1 - p_1), self.t + other.t)
+
+
+def _dec_mul(self, other):
+    """Operator * in Decimal."""
+    if not isinstance(other, numbers.Real):
+        return NotImplemented
+    p = Decimal(self.p)
+    if other == 0:
+        p = Decimal(0)
+    elif p < 1:
+        p = _m_expm1(Decimal(other)*_log1m(p))
+    return PhysicalCost(p, self.t * other)
+
+
+def _dec_sub(self, other):
+    """Operator - in Decimal."""
+    if not isinstance(other, PhysicalCost):
+        return NotImplemented
+    p_1, p_2 = Decimal(self.p), Decimal(other.p)
+    return PhysicalCost((p_1 - p_2)/(1 - p_2), self.t - other.t)
+
+
+def _dec_or(self, other):
+    """Operator | in Decimal."""
+    if not isinstance(other, PhysicalCost):
+        return NotImplemented
+    p_1, p_2 = Decimal(self.p), Decimal(other.p)
+    return PhysicalCost(p_1 + p_2*(1 - p_1), max(self.t, other.t))
+
+
+@contextmanager
+def decimal_engine():
+    """Evaluate ErrCorrCode with error probabilities as Decimal.
+
+    Error probabilities of the elementary gates are kept, then combined with
+    DIGITS significant digits: reference for precision. Too slow for
+    optimizations, where runtimes (float) are also divided by 1 - p.
+    """
+    with localcontext() as ctx, \
+            _patched(error_correction, CostAccumulator=OperatorAccumulator), \
+            _patched(PhysicalCost, __add__=_dec_add, __mul__=_dec_mul,
+                     __sub__=_dec_sub, __or__=_dec_or):
+        ctx.prec = DIGITS
+        yield
+
+
+# Engine name: context manager in which ErrCorrCode uses this engine.
+# 'baseline' is the arithmetic of the code before the engines (about 1.2 times
+# slower than this code itself, from OperatorAccumulator); 'operators' the
+# current arithmetic without CostAccumulator.
+ENGINES = {'baseline': baseline_engine,
+           'operators': operators_engine,
+           'default': nullcontext}
+# Engines reproducing the rounding errors of the code before the engines.
+ROUNDED_ENGINES = ('baseline',)
+# Engine for speed comparisons.
+SPEED_REFERENCE = 'baseline'
+
+
+def evaluate(params: Params):
+    """Error probability, runtime, processor qubits, time between readings."""
+    err_corr = ErrCorrCode(params)
+    cost = err_corr.modular_exp()
+    return (float(cost.p), cost.t, err_corr.proc_qubits,
+            err_corr.temps_inter_lectures().t)
+
+
+# %% Parameters generation
+# Same as cout_shor.MAX_WINDOW, not imported so that snapshots can be
+# generated with code predating it.
+MAX_WINDOW = 30
+
+
+def _make_params(type_, debitage, d, pp, lookup='unary', **algo):
+    """Params from flat description."""
+    # lookup only given if not default, so that snapshots can be generated
+    # with code predating it.
+    if lookup != 'unary':
+        algo['lookup'] = lookup
+    return Params(type_, AlgoOpts(**algo),
+                  LowLevelOpts(debitage=debitage, d=d, pp=pp))
+
+
+def edge_params(lookups=('unary', 'sqrt')):
+    """Edge-case parameter sets."""
+    # pylint: disable=C0103
+    for type_, windowed, debitage, deand, lookup in [
+            ('3dcolor', True, 1, True, 'unary'),
+            ('3dcolor', True, 2, False, 'sqrt'),
+            ('3dcolor', True, 2, False, 'unary'),
+            ('3dcolor', False, 1, False, 'unary'),
+            ('3dcolor', False, 2, True, 'unary'),
+            (None, True, 2, True, 'unary'),
+            (None, True, 2, True, 'sqrt'),
+            (None, False, 2, True, 'unary')]:
+        if lookup not in lookups:
+            continue
+        for n, we, wm, m, d, pp in [
+                (6, 1, 1, 1, 1, 1e-3),
+                (6, 9, 9, 1, 3, 1e-3),
+                (2048, 3, 3, 30, 47, 1e-3),
+                (2048, 9, 9, 39, 99, 1e-5),
+                (829, 1, 1, 39, 1, 0.0074),  # p near 1
+                (829, 5, 4, 20, 99, 0.0074),
+                # Large windows
+                (6, 15, 15, 1, 3, 1e-3),
+                (20, 29, 1, 5, 21, 1e-5),
+                (2048, 15, 15, 39, 99, 1e-5),
+                (829, 20, 10, 20, 41, 1e-3)]:
+            if type_ is None:
+                d, pp = None, min(0.999999, pp * 100)  # p near 1
+            if not windowed:
+                we = wm = None
+            yield _make_params(type_, debitage, d, pp, lookup, n=n,
+                               ne=ne_size(n), we=we, wm=wm, m=m,
+                               windowed=windowed, mesure_based_deand=deand)
+
+
+def random_params(rng: random.Random, lookups=('unary', 'sqrt')):
+    """Random parameter set."""
+    type_ = rng.choice(('3dcolor', None))
+    windowed = rng.random() < 0.8
+    n = rng.choice((6, 829, 2048, rng.randint(6, 4096)))
+    if windowed and rng.random() < 0.3:
+        we = rng.randint(1, MAX_WINDOW - 1)
+        wm = rng.randint(1, MAX_WINDOW - we)
+    elif windowed:
+        we, wm = rng.randint(1, 9), rng.randint(1, 9)
+    else:
+        we = wm = None
+    if type_ == '3dcolor':
+        # Below threshold, so that error probabilities stay in [0, 1].
+        d, pp = rng.randrange(1, 100, 2), 10**rng.uniform(-5, -2.13)
+    else:
+        d, pp = None, rng.choice((10**rng.uniform(-6, -1), 1 - 1e-9))
+    return _make_params(type_, rng.choice((1, 2)), d, pp,
+                        rng.choice(lookups), n=n, ne=ne_size(n), we=we,
+                        wm=wm, m=rng.randint(1, 39), windowed=windowed,
+                        mesure_based_deand=rng.random() < 0.5)
+
+
+# Optimizations compared: (type, n, biais, windowed, ranges).
+OPTIMIZATIONS = [('3dcolor', 6, 10, True, dict(ds=list(range(1, 60, 2)))),
+                 ('3dcolor', 829, 1, True, dict(ds=list(range(1, 60, 2)))),
+                 ('3dcolor', 2048, 1, False, dict(wes=[None], wms=[None])),
+                 (None, 6, 10, True, {})]
+
+
+def _base_params(type_, n, windowed):
+    """Base parameters of an optimization."""
+    return Params(type_, AlgoOpts(n=n, ne=ne_size(n), windowed=windowed),
+                  LowLevelOpts())
+
+
+# %% Snapshot
+def _to_json(params: Params):
+    """Flat description of params."""
+    return dict(type=params.type, algo=params.algo._asdict(),
+                low_level=params.low_level._asdict())
+
+
+def _from_json(desc):
+    """Params from flat description."""
+    return Params(desc['type'], AlgoOpts(**desc['algo']),
+                  LowLevelOpts(**desc['low_level']))
+
+
+def snapshot(filename, nb_random=200, seed=0):
+    """Write results of the current code, for later comparison."""
+    rng = random.Random(seed)
+    points = (list(edge_params(('unary',)))
+              + [random_params(rng, ('unary',)) for _ in range(nb_random)])
+    entries = []
+    for params in points:
+        p, t, qubits, inter = evaluate(params)
+        entries.append(dict(params=_to_json(params), p=p, t=t,
+                            qubits=qubits, inter=inter))
+    optims = []
+    for type_, n, biais, windowed, ranges in OPTIMIZATIONS:
+        best = find_best_params(_base_params(type_, n, windowed), biais,
+                                **ranges)
+        optims.append(dict(params=_to_json(best)))
+    with open(filename, 'w') as file:
+        file.write('{"points": [\n')
+        file.write(',\n'.join(json.dumps(entry) for entry in entries))
+        file.write('],\n"optimizations": [\n')
+        file.write(',\n'.join(json.dumps(optim) for optim in optims))
+        file.write(']}\n')
+
+
+# %% Comparison
+def _close(a, b, rtol, atol):
+    """Compare floats, nan and inf being equal to themselves."""
+    if isnan(a) or isnan(b):
+        return isnan(a) and isnan(b)
+    return a == b or isclose(a, b, rel_tol=rtol, abs_tol=atol)
+
+
+def rounding_atol(params: Params, t):
+    """Absolute error on p from rounding 1 - p once per elementary gate.
+
+    Code before the engines computed 1 - (1 - p)*(1 - p'), losing up to
+    one ulp of 1 per gate: only significant if some elementary gate error is
+    below ROUNDING_THRESHOLD, 0 otherwise.
+    """
+    err_corr = ErrCorrCode(params)
+    gates = (err_corr.gate1, err_corr.cnot, err_corr.init, err_corr.mesure,
+             err_corr.toffoli)
+    if min(gate.p for gate in gates) >= ROUNDING_THRESHOLD:
+        return 0
+    durations = [abs(gate.t) for gate in gates if gate.t]
+    return abs(t) / min(durations) * float_info.epsilon
+
+
+# Smallest elementary gate error computed accurately by the code before the
+# engines (see rounding_atol): above it, relative error on p was below 1e-10
+# on 1750 points; below it, up to 3e-9 at 1e-8 and 0.9 at 1e-17.
+ROUNDING_THRESHOLD = 1e-7
+
+
+def compare(ref, res, rtol=1e-9, atol=1e-15):
+    """List of the fields of res not matching ref."""
+    (ref_p, ref_t, ref_qubits, ref_inter), (p, t, qubits, inter) = ref, res
+    mismatches = []
+    if not _close(ref_p, p, rtol, atol):
+        mismatches.append(('p', ref_p, p))
+    if not _close(ref_t, t, rtol, 0):
+        mismatches.append(('t', ref_t, t))
+    if ref_qubits != qubits:
+        mismatches.append(('qubits', ref_qubits, qubits))
+    if not _close(ref_inter, inter, rtol, 0):
+        mismatches.append(('temps_inter_lectures', ref_inter, inter))
+    return mismatches
+
+
+def _compare_all(title, points, refs, results, rtol, atol, rounded=False):
+    """Compare results with refs on all points; number of mismatches.
+
+    If rounded, results come with the rounding errors of the code before the
+    engines.
+    """
+    nb_errors = 0
+    for params, ref, res in zip(points, refs, results):
+        tol = max(atol, 4*rounding_atol(params, ref[1])) if rounded else atol
+        mismatches = compare(ref, res, rtol, tol)
+        if mismatches:
+            nb_errors += 1
+            print(title, params)
+            for field, expected, obtained in mismatches:
+                print(f"\t{field}: {expected} != {obtained}")
+    print(f"{title} {nb_errors}/{len(points)} points.")
+    return nb_errors
+
+
+def cross_check(nb_random=1000, seed=0, rtol=1e-9, atol=1e-15):
+    """Compare baseline snapshot and engines with the decimal engine.
+
+    Returns the number of mismatches.
+    """
+    with open(BASELINE) as file:
+        baseline = json.load(file)
+    base_points = [_from_json(entry['params'])
+                   for entry in baseline['points']]
+    rng = random.Random(seed)
+    points = (list(edge_params())
+              + [random_params(rng) for _ in range(nb_random)])
+    with decimal_engine():
+        start = perf_counter()
+        refs = [evaluate(params) for params in points]
+        ref_duration = perf_counter() - start
+        base_refs = [evaluate(params) for params in base_points]
+    errors = _compare_all(
+        "Mismatch of baseline snapshot with 'decimal':", base_points,
+        base_refs, [(entry['p'], entry['t'], entry['qubits'], entry['inter'])
+                    for entry in baseline['points']],
+        rtol, atol, rounded=True)
+    durations = {}
+    for name, engine in ENGINES.items():
+        with engine():
+            start = perf_counter()
+            results = [evaluate(params) for params in points]
+            durations[name] = perf_counter() - start
+        errors += _compare_all(f"Mismatch of '{name}' with 'decimal':",
+                               points, refs, results, rtol, atol,
+                               rounded=name in ROUNDED_ENGINES)
+    print(f"Tolerances: rtol={rtol}, atol={atol}; rounding errors allowed "
+          f"for gate errors below {ROUNDING_THRESHOLD}.")
+    print(f"\t{'decimal':<12} {len(points)/ref_duration:10.0f} points/s")
+    for name, duration in durations.items():
+        print(f"\t{name:<12} {len(points)/duration:10.0f} points/s, "
+              f"{durations[SPEED_REFERENCE]/duration:.2f} times "
+              f"'{SPEED_REFERENCE}' speed")
+    return errors
+
+
+def cross_check_optimization():
+    """Compare find_best_params results of the engines.
+
+    Expected results are the baseline snapshot, or those of the 'baseline'
+    engine when memory readout speed is taken into account. The decimal
+    engine is not used. Returns the number of mismatches.
+    """
+    with open(BASELINE) as file:
+        baseline = [_from_json(optim['params'])
+                    for optim in json.load(file)['optimizations']]
+    errors = 0
+    for (type_, n, biais, windowed, ranges), base_best in zip(OPTIMIZATIONS,
+                                                              baseline):
+        base_params = _base_params(type_, n, windowed)
+        for speed in (None, cout_shor.READOUT_SPEED):
+            bests = {}
+            for name, engine in ENGINES.items():
+                with engine():
+                    start = perf_counter()
+                    bests[name] = find_best_params(base_params, biais,
+                                                   speed=speed, **ranges)
+                print(f"\t{name:<12} n={n}, type={type_}, "
+                      f"windowed={windowed}, speed={speed}: "
+                      f"{perf_counter() - start:.2f} s")
+            expected = base_best if speed is None else bests['baseline']
+            for name, best in bests.items():
+                if best != expected:
+                    errors += 1
+                    print(f"Optimization mismatch for engine '{name}':",
+                          expected, best, sep='\n\t')
+    print(f"Optimization: {errors} mismatches.")
+    return errors
+
+
+# %% Executable part
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('-n', '--nb-random', type=int, default=1000,
+                        help="number of random points")
+    parser.add_argument('-s', '--seed', type=int, default=0)
+    parser.add_argument('--rtol', type=float, default=1e-9)
+    parser.add_argument('--atol', type=float, default=1e-15)
+    parser.add_argument('--no-optim', action='store_true',
+                        help="skip find_best_params comparison")
+    parser.add_argument('--snapshot', metavar='FILE',
+                        help="only write results of the current code in FILE")
+    args = parser.parse_args()
+    if args.snapshot:
+        snapshot(args.snapshot)
+        raise SystemExit(0)
+    nb_errors = cross_check(args.nb_random, args.seed, args.rtol, args.atol)
+    if not args.no_optim:
+        nb_errors += cross_check_optimization()
+    raise SystemExit(1 if nb_errors else 0)
@@ -6,9 +6,18 @@ Tools for describing error correction and cost of logical circuits.
 
 @author: Élie Gouzien
 """
-from math import exp, log, floor, ceil
+from math import exp, log, log2, floor, ceil
 
-from tools import Params, PhysicalCost
+from tools import Params, PhysicalCost, CostAccumulator
+
+
+def select_swap_size(w, n):
+    """Log2 of the number of output registers of select-swap lookup.
+
+    Address (target) of size w (n). Following arXiv:1812.00954, 2**k is
+    about sqrt(2**w/n), and at most 2**floor(w/2).
+    """
+    return min(max(round((w - log2(n))/2), 0), floor(w/2))
 
 
 class ErrCorrCode:
@@ -45,6 +54,8 @@ class ErrCorrCode:
         self.memory_qubits = None
         self.space_modes = None
         self.time_modes = None
+        # Cache of _product_addition()
+        self._product_add = None
 
     @property
     def and_gate(self):
@@ -98,7 +109,8 @@ class ErrCorrCode:
         """Cost of full adder modulo power of two (with ancillary qubits)."""
         if n is None:  # coset representation
             n = self.params.algo.n + self.params.algo.m
-        return (n - 2)*(self.maj + self.uma) + 3*self.cnot + self.and_deand
+        return (CostAccumulator().add(self.maj, n - 2).add(self.uma, n - 2)
+                .add(self.cnot, 3).add(self.and_deand).total())
 
     @property
     def semi_classical_ctrl_maj(self):
@@ -114,9 +126,10 @@ class ErrCorrCode:
         """Cost of controlled semi-classical addition."""
         if n is None:  # coset representation
             n = self.params.algo.n + self.params.algo.m
-        return ((n-2)*(self.semi_classical_ctrl_maj
-                       + self.semi_classical_ctrl_uma)
-                + 2*self.cnot + 0.5*self.and_deand)
+        return (CostAccumulator()
+                .add(self.semi_classical_ctrl_maj, n-2)
+                .add(self.semi_classical_ctrl_uma, n-2)
+                .add(self.cnot, 2).add(self.and_deand, 0.5).total())
 
     def semi_classical_ctrl_ctrl_add(self, n=None):
         """Cost of doubly controlled semi-classical addition."""
@@ -136,9 +149,10 @@ class ErrCorrCode:
         """Semi-classical comparison."""
         if n is None:  # coset representation
             n = self.params.algo.n + self.params.algo.m
-        return ((n-1)*(self.semi_classical_maj
-                       + self.semi_classical_maj_dag)
-                + self.cnot)
+        return (CostAccumulator()
+                .add(self.semi_classical_maj, n-1)
+                .add(self.semi_classical_maj_dag, n-1)
+                .add(self.cnot).total())
 
     def _defaul_lookup_sizes(self):
         """Computes default sizes 'w' et 'n' for table lookup."""
@@ -152,25 +166,54 @@ class ErrCorrCode:
         """Cost of table-lookup circuit, address (target) of sizes w (n)."""
         if w is None and n is None:
             w, n = self._defaul_lookup_sizes()
-        return (2*self.gate1 + (2**w - 2 + 2**w * n/2)*self.cnot
-                + (2**w - 2)*self.and_deand)
+        if self.params.algo.lookup == 'unary':
+            return self._unary_lookup(w, n)
+        if self.params.algo.lookup == 'sqrt':
+            return self._select_swap_lookup(w, n)
+        raise ValueError("'lookup' takes value 'unary' or 'sqrt'.")
+
+    def _unary_lookup(self, w, n):
+        """Table-lookup with unary iteration over all addresses."""
+        # See arXiv:1805.03662
+        return (CostAccumulator()
+                .add(self.gate1, 2)
+                .add(self.cnot, 2**w - 2 + 2**w * n/2)
+                .add(self.and_deand, 2**w - 2).total())
+
+    def _select_swap_lookup(self, w, n):
+        """Table-lookup with 2**k output registers (select-swap)."""
+        # See arXiv:1812.00954: unary iteration on high part of the address
+        # writes all registers, then swap network controlled by low part.
+        k = select_swap_size(w, n)
+        return (CostAccumulator()
+                .add(self.gate1, 2)
+                .add(self.cnot, 2**(w-k) - 2 + 2**w * n/2 + 2*(2**k - 1)*n)
+                .add(self.and_deand, 2**(w-k) - 2)
+                .add(self.toffoli, (2**k - 1)*n).total())
 
     def unary_ununairy(self, size=None):
         """Cost of unary representation computation and uncomputation."""
         # first NOT is not counted as |1> can be directly initialized.
         if size is None:
             size = floor((self.params.algo.we + self.params.algo.wm)/2)
-        return self.init + 2*(size-1)*self.cnot + (size-1)*self.and_deand
+        return (CostAccumulator()
+                .add(self.init).add(self.cnot, 2*(size-1))
+                .add(self.and_deand, size-1).total())
 
     def unlookup(self, w=None, n=None):
         """Cost of table-lookup uncomputation."""
         # Hadamard gates are merged with preparation/measurement.
         if w is None and n is None:
             w, n = self._defaul_lookup_sizes()
-        return (n*self.mesure
-                + self.unary_ununairy(floor(w/2))
+        # With select-swap, all registers are measured; phase fixup depends on
+        # full address anyway.
+        registers = (2**select_swap_size(w, n)
+                     if self.params.algo.lookup == 'sqrt' else 1)
+        return (CostAccumulator()
+                .add(self.mesure, registers*n)
+                .add(self.unary_ununairy(floor(w/2)))
                 # + 2*floor(w/2)*self.gate1  # CZ same cost as CNOT
-                + self.lookup(w=ceil(w/2), n=floor(w/2)))
+                .add(self._unary_lookup(ceil(w/2), floor(w/2))).total())
 
     def look_unlookup(self, w=None, n=None):
         """Cost of table lookup and unlookup."""
@@ -182,26 +225,44 @@ class ErrCorrCode:
         """Coset representation register initialization."""
         # Hadamard gates are merged with preparation/measurement.
         n, m = self.params.algo.n, self.params.algo.m
-        return (m*(self.init + self.mesure)
-                + m*self.semi_classical_ctrl_add(n+m)
-                + 0.5*m*(self.semi_classical_comparison(n+m) + self.gate1))
+        return (CostAccumulator()
+                .add(self.init, m).add(self.mesure, m)
+                .add(self.semi_classical_ctrl_add(n+m), m)
+                .add(self.semi_classical_comparison(n+m), 0.5*m)
+                .add(self.gate1, 0.5*m).total())
+
+    def _product_addition(self):
+        """Cost of one addition and table lookup, windowed arithmetics.
+
+        Computed once, as shared by modular_exp and temps_inter_lectures.
+        """
+        if self._product_add is None:
+            self._product_add = (CostAccumulator()
+                                 .add(self.add()).add(self.look_unlookup())
+                                 .total())
+        return self._product_add
 
     def modular_exp_windowed(self):
         """Cost of modular exponentiation, with windowed arithmetics."""
-        n, ne, we, wm, m, _, _ = self.params.algo
+        n, ne, we, wm, m, _, _, _ = self.params.algo
         nb = 2 * (ne/we) * (n + m)/wm
         classical_error = PhysicalCost(2**(-m), 0)
-        return (nb*(self.add() + self.look_unlookup() + classical_error)
-                + 2*self.initialize_coset_reg())
+        return (CostAccumulator()
+                .add(self._product_addition(), nb)
+                .add(classical_error, nb)
+                .add(self.initialize_coset_reg(), 2).total())
 
     def modular_exp_controlled(self):
         """Cost of modular exponentiation, with controlled arithmetics."""
-        n, ne, _, _, m, _, _ = self.params.algo
+        n, ne, _, _, m, _, _, _ = self.params.algo
         nb = 2 * ne * (n + m)
         classical_error = PhysicalCost(2**(-m), 0)
-        return (nb*(self.semi_classical_ctrl_ctrl_add() + classical_error)
-                + 2 * self.initialize_coset_reg()
-                + ne*(n + m)*(2*self.cnot + self.toffoli))
+        return (CostAccumulator()
+                .add(self.semi_classical_ctrl_ctrl_add(), nb)
+                .add(classical_error, nb)
+                .add(self.initialize_coset_reg(), 2)
+                .add(self.cnot, 2*ne*(n + m)).add(self.toffoli, ne*(n + m))
+                .total())
 
     def modular_exp(self):
         """Modular exponentiation cost, version taken from parameters."""
@@ -212,14 +273,15 @@ class ErrCorrCode:
     def temps_inter_lectures(self):
         """Max time between two reading of a given qubit."""
         # Time of one product-addition
-        n, _, _, wm, m, _, _ = self.params.algo
+        n, _, _, wm, m, _, _, _ = self.params.algo
         if self.params.algo.windowed:
             nb = (n + m)/wm
-            res = nb*(self.add() + self.look_unlookup())
+            res = CostAccumulator().add(self._product_addition(), nb).total()
             return res._replace(p=None)
         else:
             nb = n + m
-            res = nb*self.semi_classical_ctrl_ctrl_add()
+            res = (CostAccumulator()
+                   .add(self.semi_classical_ctrl_ctrl_add(), nb).total())
             return res._replace(p=None)
 
 
@@ -256,7 +318,7 @@ class ThreeDGaugeCode(ErrCorrCode):
         β = 0.822
         # logical error: arXiv:1503.08217
         err = A * exp(α * log(params.low_level.pp/p_th) * d**β)
-        err_2 = 1 - (1 - err)**2
+        err_2 = err*(2 - err)  # 1 - (1 - err)**2, exact for small err
         # 2 factor: one time for gate, one time for stabilizers measurement
         # actual correction delayed to next use and neglected.
         time = 2*params.low_level.tc*self.time_modes
@@ -286,8 +348,10 @@ class NoCorrCode(ErrCorrCode):
     def __init__(self, params: Params):
         """Init no correction instance."""
         super().__init__(params)
-        err_2 = 1 - (1 - params.low_level.pp)**2
-        err_3 = 1 - (1 - params.low_level.pp)**3
+        pp = params.low_level.pp
+        # 1 - (1 - pp)**2 and 1 - (1 - pp)**3, exact for small pp
+        err_2 = pp*(2 - pp)
+        err_3 = pp*(3 - 3*pp + pp**2)
         self.gate1 = PhysicalCost(params.low_level.pp, params.low_level.tc)
         self.cnot = PhysicalCost(err_2, params.low_level.tc)
         self.toffoli = PhysicalCost(err_3, params.low_level.tc)
@@ -328,4 +392,5 @@ class NoCorrCode(ErrCorrCode):
         # See arXiv:quant-ph/0410184
         if n is None:  # coset representation
             n = self.params.algo.n + self.params.algo.m
-        return (n - 3)*(self.maj + self.uma) + 7*self.cnot + 3*self.toffoli
+        return (CostAccumulator().add(self.maj, n - 3).add(self.uma, n - 3)
+                .add(self.cnot, 7).add(self.toffoli, 3).total())
@@ -8,11 +8,14 @@ Tools for algorithmic resource estimate.
 import numbers
 from collections import namedtuple
 from datetime import timedelta
+from math import expm1, log1p
 
 AlgoOpts = namedtuple('AlgoOpts',
-                      'n, ne, we, wm, m, windowed, mesure_based_deand',
-                      defaults=(None, None, None, None, None, True, True))
-AlgoOpts.__doc__ = """AlgoOpts(n, ne, we, wm, m, windowed, mesure_based_deand)
+                      'n, ne, we, wm, m, windowed, mesure_based_deand, lookup',
+                      defaults=(None, None, None, None, None, True, True,
+                                'unary'))
+AlgoOpts.__doc__ = """AlgoOpts(n, ne, we, wm, m, windowed, mesure_based_deand,
+         lookup)
 
 Parameters:
     n  : number of bits of N
@@ -24,6 +27,10 @@ Parameters:
     mesure_based_deand : measurement based AND uncomputation
                         (only for type == '3dcolor', otherwise take the
                          obvious option without considering this parameter)
+    lookup : table lookup construction
+             'unary' is unary iteration over all addresses (arXiv:1805.03662)
+             'sqrt' is select-swap with about sqrt(2**w/n) output registers
+                    (arXiv:1812.00954), trading memory for AND gates
 """
 
 LowLevelOpts = namedtuple('LowLevelOpts', 'debitage, d1, d, tc, tr, pp',
@@ -51,6 +58,17 @@ Parameters:
 """
 
 
+def _either(p1, p2):
+    """Probability of failure of either of two steps.
+
+    Same as 1 - (1 - p1)*(1 - p2), without cancellation for small errors and
+    exact for p = 1.
+    """
+    if p1 < p2:
+        p1, p2 = p2, p1
+    return p1 + p2*(1 - p1)
+
+
 class PhysicalCost(namedtuple('PhysicalCost', ('p', 't'))):
     """Physical cost of some gates: error probability and runtime.
 
@@ -75,7 +93,7 @@ class PhysicalCost(namedtuple('PhysicalCost', ('p', 't'))):
         """Cost of sequential execution of self and other."""
         if not isinstance(other, __class__):
             return NotImplemented
-        return __class__(1 - (1 - self.p)*(1 - other.p), self.t + other.t)
+        return __class__(_either(self.p, other.p), self.t + other.t)
 
     def __mul__(self, other):
         """
@@ -84,9 +102,13 @@ class PhysicalCost(namedtuple('PhysicalCost', ('p', 't'))):
         Other does not need to be integer (as some gates are probabilistically
                                            applied).
         """
-        if not isinstance(other, numbers.Real):
+        # int and float checked first, as much faster than the ABC.
+        if (not isinstance(other, (int, float))
+                and not isinstance(other, numbers.Real)):
             return NotImplemented
-        return __class__(1 - (1 - self.p)**other, self.t * other)
+        if self.p >= 1:
+            return __class__(1 - (1 - self.p)**other, self.t * other)
+        return __class__(-expm1(other*log1p(-self.p)), self.t * other)
 
     def __rmul__(self, other):
         """Right multiplication."""
@@ -94,13 +116,15 @@ class PhysicalCost(namedtuple('PhysicalCost', ('p', 't'))):
 
     def __sub__(self, other):
         """Subtraction: revert previous of future addition."""
-        return self + (-1 * other)
+        if not isinstance(other, __class__):
+            return NotImplemented
+        return __class__((self.p - other.p)/(1 - other.p), self.t - other.t)
 
     def __or__(self, other):
         """Cost of parallel execution of self and other."""
         if not isinstance(other, __class__):
             return NotImplemented
-        return __class__(1 - (1 - self.p)*(1-other.p), max(self.t, other.t))
+        return __class__(_either(self.p, other.p), max(self.t, other.t))
 
     @property
     def exp_t(self):
@@ -132,3 +156,39 @@ class PhysicalCost(namedtuple('PhysicalCost', ('p', 't'))):
             else:
                 t = str(round(self.t/(3600*24*365.25))) + " years"
         return f"PhysicalCost(p={self.p}, t={t}, exp_t={self.exp_t_str})"
+
+
+class CostAccumulator:
+    """Accumulator for the cost of long serial executions.
+
+    Equivalent to summing PhysicalCost, but with plain floats, the error
+    probability being tracked as log(1-p). Intended for the innermost
+    expressions of the estimates, where building intermediate PhysicalCost
+    dominates the evaluation time.
+
+    Example
+    -------
+        acc = CostAccumulator()
+        acc.add(a, k).add(b)
+        acc.total()  # same as k*a + b
+
+    """
+
+    __slots__ = ('log_q', 't')
+
+    def __init__(self):
+        """Start from an empty circuit."""
+        self.log_q = 0.  # log(1-p)
+        self.t = 0.
+
+    def add(self, cost, k=1):
+        """Add serial execution of cost k times (k can be float)."""
+        p, t = cost
+        if k:
+            self.log_q += k*log1p(-p) if p < 1 else float('-inf')
+            self.t += k*t
+        return self
+
+    def total(self):
+        """Accumulated cost, as a PhysicalCost."""
+        return PhysicalCost(-expm1(self.log_q), self.t)